@@ -3,23 +3,82 @@ Telegram Bot implementation with rate limiting and webhook support
 Optimized for Render.com deployment with automatic predictions
 """
 import os
+import hashlib
 import logging
 import requests
-import json
+import orjson
+import random
+import threading
 import time
+from collections import OrderedDict
 from typing import Dict, Any
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
 from handlers import TelegramHandlers
+from rate_limiter import ConcurrencyLimiter, RateLimiter
 
 logger = logging.getLogger(__name__)
 
+# Outbound retry policy: capped exponential backoff with jitter
+SEND_MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+BACKOFF_JITTER = 0.5
+RETRY_STATUS_CODES = frozenset({429, 502, 503})
+
+# Identical (chat, text) sends within this window are treated as retries and dropped
+IDEMPOTENCY_CACHE_SIZE = 2048
+IDEMPOTENCY_TTL = 300.0
+
+# Request bodies are pre-serialized with orjson, so the content type is set explicitly
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+def _json_request(data: Dict[str, Any]):
+    """Request factory for a JSON body, serialized once and reused on every attempt"""
+    body = orjson.dumps(data)
+    return lambda: (body, JSON_HEADERS)
+
+def _not_sent(error: Exception) -> bool:
+    """Whether a network error happened before the request left (refused, DNS failure, connect timeout)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying failure
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+def _build_session(pool_size: int) -> requests.Session:
+    """Create a keep-alive session with its own connection pool"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0))
+    return session
+
 class TelegramBot:
     """Main Telegram bot class with advanced features"""
     
-    def __init__(self, token: str):
+    def __init__(self, token: str, connection_pool_size: int = 32, admin_pool_size: int = 4,
+                 max_connections: int = 10):
         self.token = token
+        # Parallel webhook connections Telegram may open to us (1-100)
+        self.max_connections = max_connections
         self.base_url = f"https://api.telegram.org/bot{token}"
-        # Initialize handlers for message processing
-        self.handlers = TelegramHandlers(token)
+        self._send_url = f"{self.base_url}/sendMessage"
+        self._edit_url = f"{self.base_url}/editMessageText"
+        self._document_url = f"{self.base_url}/sendDocument"
+        self._webhook_url = f"{self.base_url}/setWebhook"
+        self._get_me_url = f"{self.base_url}/getMe"
+        # Separate keep-alive pools so slow admin calls never starve outbound sends
+        self.send_session = _build_session(connection_pool_size)
+        self.admin_session = _build_session(admin_pool_size)
+        # Proactive client-side limiter so requests stay under Telegram's quotas
+        self.rate_limiter = RateLimiter()
+        # Adaptive cap on in-flight sends, backs off quickly when Telegram pushes back
+        self.concurrency = ConcurrencyLimiter(connection_pool_size)
+        # Idempotency key -> monotonic send time of recently delivered messages
+        self._recent_sends: OrderedDict = OrderedDict()
+        self._recent_sends_lock = threading.Lock()
+        # Initialize handlers for message processing; their API calls go through this bot
+        self.handlers = TelegramHandlers(self)
 
     def handle_update(self, update: Dict[str, Any]) -> None:
         """Handle incoming Telegram update via webhook"""
@@ -35,53 +94,143 @@ class TelegramBot:
         except Exception as e:
             logger.error(f"❌ Error handling update: {e}")
 
-    def send_message(self, chat_id: int, text: str) -> bool:
-        """Send text message with rate limiting protection"""
-        try:
-            url = f"{self.base_url}/sendMessage"
-            data = {
-                'chat_id': chat_id,
-                'text': text,
-                'parse_mode': 'HTML'
-            }
+    def send_message(self, chat_id: int, text: str, *, dedupe: bool = False):
+        """Send text message with rate limiting protection; with dedupe, at most once per
+        idempotency window. Returns the sent message (with its message_id), True for a skipped
+        duplicate, False on failure, or None when the outcome is unknown"""
+        if not dedupe:
+            return self._post_message(chat_id, text)
+
+        key = hashlib.blake2b(f"{chat_id}:{text}".encode(), digest_size=8).hexdigest()
+        now = time.monotonic()
+        with self._recent_sends_lock:
+            sent_at = self._recent_sends.get(key)
+            if sent_at is not None and now - sent_at < IDEMPOTENCY_TTL:
+                logger.info("Duplicate message to chat %s skipped", chat_id)
+                return True
+            # Reserve the key so a concurrent identical send is dropped too
+            self._recent_sends[key] = now
+            self._recent_sends.move_to_end(key)
+            while len(self._recent_sends) > IDEMPOTENCY_CACHE_SIZE:
+                self._recent_sends.popitem(last=False)
 
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
+        sent = self._post_message(chat_id, text)
+        # None means it may have been delivered: keep the key so a redelivered update doesn't repost it
+        if sent is False:
+            with self._recent_sends_lock:
+                self._recent_sends.pop(key, None)
+        return sent
 
-            if result.get('ok'):
-                logger.info(f"Message sent successfully to chat {chat_id}")
+    def _post_message(self, chat_id: int, text: str):
+        """POST sendMessage; return the sent message, False, or None when the outcome is unknown"""
+        data = {
+            'chat_id': chat_id,
+            'text': text,
+            'parse_mode': 'HTML'
+        }
+        result = self._call(self._send_url, chat_id, _json_request(data))
+        if result:
+            logger.info("Message sent successfully to chat %s", chat_id)
+        return result
+
+    def edit_message(self, chat_id: int, message_id: int, text: str) -> bool:
+        """Edit an existing message through the same throttled path as sends"""
+        data = {
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'text': text,
+            'parse_mode': 'HTML'
+        }
+        if self._call(self._edit_url, chat_id, _json_request(data), idempotent=True):
+            logger.info("Message edited successfully in chat %s", chat_id)
+            return True
+        return False
+
+    def send_document(self, chat_id: int, file_path: str, caption: str) -> bool:
+        """Upload a file with sendDocument through the same throttled path as sends"""
+        with open(file_path, 'rb') as file:
+            def make_request():
+                # The streamed multipart body cannot be rewound, so every attempt builds a new one
+                file.seek(0)
+                encoder = MultipartEncoder(fields={
+                    'chat_id': str(chat_id),
+                    'caption': caption,
+                    'document': (os.path.basename(file_path), file, 'application/zip')
+                })
+                return encoder, {'Content-Type': encoder.content_type}
+
+            if self._call(self._document_url, chat_id, make_request, timeout=60):
+                logger.info("Document sent successfully to chat %s", chat_id)
                 return True
-            else:
-                # Handle rate limiting error with automatic retry
-                if result.get('error_code') == 429:
-                    retry_after = result.get('parameters', {}).get('retry_after', 1)
-                    logger.warning(f"Rate limited. Retrying after {retry_after} seconds...")
-                    time.sleep(retry_after + 1)
-                    # Retry once after waiting
-                    response = requests.post(url, json=data, timeout=10)
-                    result = response.json()
-                    if result.get('ok'):
-                        logger.info(f"Message sent successfully after retry")
-                        return True
-                
-                logger.error(f"Failed to send message: {result}")
-                return False
+            return False
+
+    def _call(self, url: str, chat_id: int, make_request, timeout: float = 10, idempotent: bool = False):
+        """POST a Bot API method with client-side throttling and retries; return its result or False.
+        make_request() returns the (body, headers) of one attempt. A non-idempotent call that fails
+        after the request may have reached Telegram is not retried and returns None (outcome unknown)"""
+        method = url.rsplit('/', 1)[-1]
+        try:
+            result = None
+            for attempt in range(SEND_MAX_RETRIES):
+                # Wait for a free slot (also honours cooldowns from earlier 429s)
+                self.rate_limiter.wait(chat_id)
+
+                delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) + random.uniform(0, BACKOFF_JITTER)
+                self.concurrency.acquire()
+                started = time.monotonic()
+                response = None
+                try:
+                    body, headers = make_request()
+                    response = self.send_session.post(url, data=body, headers=headers, timeout=timeout)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    logger.warning(f"{method} attempt {attempt + 1} failed: {e}")
+                    # Failures before sending are always retried; read-side ones only when idempotent
+                    if not idempotent and not _not_sent(e):
+                        # Telegram may already have processed it: retrying could post it twice
+                        logger.error(f"{method} outcome unknown, not retried")
+                        return None
+                finally:
+                    self.concurrency.release(time.monotonic() - started,
+                                             response is None or response.status_code in RETRY_STATUS_CODES)
+                if response is None:
+                    time.sleep(delay)
+                    continue
+
+                self.rate_limiter.update_from_headers(response.headers)
+                if response.status_code in RETRY_STATUS_CODES:
+                    if response.status_code == 429:
+                        result = orjson.loads(response.content)
+                        retry_after = result.get('parameters', {}).get('retry_after', 1)
+                        delay = max(delay, retry_after)
+                    logger.warning(f"HTTP {response.status_code}. Retrying in {delay:.1f} seconds...")
+                    self.rate_limiter.cooldown(chat_id, delay)
+                    continue
+
+                result = orjson.loads(response.content)
+                if result.get('ok'):
+                    return result.get('result', True)
+                break
+
+            logger.error(f"Failed {method}: {result}")
+            return False
 
         except Exception as e:
-            logger.error(f"Error sending message: {e}")
+            logger.error(f"Error calling {method}: {e}")
             return False
 
-    def set_webhook(self, webhook_url: str) -> bool:
+    def set_webhook(self, webhook_url: str, drop_pending_updates: bool = False) -> bool:
         """Set webhook URL for the bot"""
         try:
-            url = f"{self.base_url}/setWebhook"
+            url = self._webhook_url
             data = {
                 'url': webhook_url,
-                'allowed_updates': ['message', 'edited_message']
+                'allowed_updates': ['message', 'edited_message'],
+                'max_connections': self.max_connections,
+                'drop_pending_updates': drop_pending_updates
             }
 
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
+            response = self.admin_session.post(url, data=orjson.dumps(data), headers=JSON_HEADERS, timeout=10)
+            result = orjson.loads(response.content)
 
             if result.get('ok'):
                 logger.info(f"Webhook set successfully: {webhook_url}")
@@ -97,9 +246,9 @@ class TelegramBot:
     def get_bot_info(self) -> Dict[str, Any]:
         """Get bot information"""
         try:
-            url = f"{self.base_url}/getMe"
-            response = requests.get(url, timeout=30)
-            result = response.json()
+            url = self._get_me_url
+            response = self.admin_session.get(url, timeout=30)
+            result = orjson.loads(response.content)
 
             if result.get('ok'):
                 return result.get('result', {})
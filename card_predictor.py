@@ -2,10 +2,16 @@
 Card prediction logic for Joker's Telegram Bot - simplified for webhook deployment
 """
 
+import os
 import re
 import logging
-from datetime import datetime
-from typing import Optional, Dict, List, Tuple
+import sqlite3
+import time
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from typing import FrozenSet, Optional, Dict, List, Tuple
+from prediction_store import STATE_RETENTION, PredictionStore
 
 logger = logging.getLogger(__name__)
 
@@ -17,17 +23,204 @@ VALID_CARD_COMBINATIONS = [
 CARD_SYMBOLS = ["♠️", "♥️", "♦️", "♣️", "❤️"]  # Include both ♥️ and ❤️ variants
 
 PREDICTION_MESSAGE = "🔵{numero} 🔵3K: statut :⏳"
+STATUS_MESSAGE = "🔵{numero} 🔵3K: statut :{statut}"
+FAILED_STATUS = '⭕⭕'
+_STATUS_BY_OFFSET = ('✅0️⃣', '✅1️⃣', '✅2️⃣', '✅3️⃣')  # success status by verification offset
+
+# Bounded memory for duplicate detection: oldest entries go first, expired ones too
+MAX_PROCESSED_MESSAGES = 10000
+PROCESSED_MESSAGE_TTL = 3600  # seconds
+MAX_TRACKED_MESSAGES = 4096  # temporary_messages / pending_edits
+
+# SQLite file holding predictions across restarts (empty string disables persistence)
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'state.db')
+
+PENDING_INDICATORS = ('⏰', '▶', '🕐', '➡️')
+COMPLETION_INDICATORS = ('✅', '🔰')
+
+# Precompiled patterns used on every incoming message
+_GAME_RE = re.compile(r'#[nN](\d+)', re.ASCII)
+_PAREN_RE = re.compile(r'\(([^)]+)\)')
+
+def _indicator_pattern(indicators: Tuple[str, ...]) -> str:
+    """Single-codepoint indicators as one character class, longer ones as alternatives"""
+    single = ''.join(re.escape(i) for i in indicators if len(i) == 1)
+    multi = [re.escape(i) for i in indicators if len(i) > 1]
+    return '|'.join(([f'[{single}]'] if single else []) + multi)
+
+# Both indicator families in one pattern, told apart by the named group that matched
+_INDICATOR_RE = re.compile(
+    f'(?P<pending>{_indicator_pattern(PENDING_INDICATORS)})'
+    f'|(?P<completion>{_indicator_pattern(COMPLETION_INDICATORS)})'
+)
+
+# Message classification bits returned by CardPredictor.classify
+MESSAGE_PENDING = 1
+MESSAGE_COMPLETION = 2
+_INDICATOR_FLAGS = {'pending': MESSAGE_PENDING, 'completion': MESSAGE_COMPLETION}
+
+# Suit characters without the trailing variation selector (U+FE0F), which is optional;
+# ❤ counts as ♥
+_SUIT_CHARS_RE = re.compile('[♠♥❤♦♣]')
+# Each suit is one bit of a 4-bit mask; a section's suits are the OR of its bits
+_SUIT_BIT = {'♠': 1, '♥': 2, '❤': 2, '♦': 4, '♣': 8}
+_SUIT_CHARS = frozenset(_SUIT_BIT)
+_SUIT_SYMBOLS = ('♠️', '♥️', '♦️', '♣️')  # indexed by bit position
+
+def _suit_mask(text: str) -> int:
+    """Bitmask of the suits present in text"""
+    mask = 0
+    for ch in _SUIT_CHARS.intersection(text):
+        mask |= _SUIT_BIT[ch]
+    return mask
+
+_SYMBOLS_BY_MASK = tuple(
+    tuple(symbol for bit, symbol in enumerate(_SUIT_SYMBOLS) if mask >> bit & 1)
+    for mask in range(16)
+)
+
+# Valid combinations by mask, mapped to their canonical (sorted) string form
+_COMBINATION_BY_MASK = {
+    mask: ''.join(sorted(_SYMBOLS_BY_MASK[mask]))
+    for mask in map(_suit_mask, VALID_CARD_COMBINATIONS)
+}
+
+# The same text is parsed by both prediction and verification, so parses are memoized
+PARSE_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_game_number(message: str) -> Optional[int]:
+    """Game number from #nXXX / #NXXX, cached per message text"""
+    match = _GAME_RE.search(message)
+    if match:
+        return int(match.group(1))
+    return None
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _classify_message(text: str) -> int:
+    """Indicator bits (MESSAGE_PENDING | MESSAGE_COMPLETION) found in one scan, cached per text"""
+    flags = 0
+    for match in _INDICATOR_RE.finditer(text):
+        flags |= _INDICATOR_FLAGS[match.lastgroup]
+        if flags == MESSAGE_PENDING | MESSAGE_COMPLETION:
+            break
+    return flags
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_suit_masks(text: str) -> Tuple[int, ...]:
+    """Suit bitmask of each parentheses section, cached per message text"""
+    return tuple(map(_suit_mask, _PAREN_RE.findall(text)))
+
+# Only a handful of suit sets exist, so combination checks are memoized on the set
+COMBINATION_CACHE_SIZE = 64
+
+@lru_cache(maxsize=COMBINATION_CACHE_SIZE)
+def _card_combination(cards: FrozenSet[str]) -> Optional[str]:
+    """Canonical (sorted) string of exactly 3 different cards, None otherwise"""
+    if len(cards) != 3:
+        return None
+    # Every set of 3 different suits is accepted, valid patterns included
+    return ''.join(sorted(cards))
+
+@lru_cache(maxsize=COMBINATION_CACHE_SIZE)
+def _has_three_different_cards(cards: FrozenSet[str]) -> bool:
+    """True if the set holds exactly 3 different card symbols"""
+    return len(cards) == 3
+
+# Everything prediction and verification read from a message, parsed once per text
+ParsedMessage = namedtuple('ParsedMessage', ['text', 'game_number', 'first_section', 'flags'])
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_message(text: str) -> ParsedMessage:
+    """Game number, first parentheses content and indicator bits of a message"""
+    match = _PAREN_RE.search(text)
+    return ParsedMessage(text, _parse_game_number(text), match.group(1) if match else None,
+                         _classify_message(text))
+
+class BoundedDict(OrderedDict):
+    """Insertion-ordered dict that drops its oldest entries beyond maxlen"""
+    
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        super().__init__()
+    
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxlen:
+            self.popitem(last=False)
 
 class CardPredictor:
     """Handles card prediction logic for webhook deployment"""
     
-    def __init__(self):
+    PENDING = MESSAGE_PENDING
+    COMPLETION = MESSAGE_COMPLETION
+    
+    __slots__ = (
+        'predictions', 'processed_messages', 'sent_predictions', 'temporary_messages', 'pending_edits',
+        '_pending_games', '_dirty_predictions', '_dirty_sent', '_store'
+    )
+    
+    def __init__(self, state_path: str = STATE_DB_PATH):
         self.predictions = {}  # Store predictions for verification
-        self.processed_messages = set()  # Avoid duplicate processing
-        self.sent_predictions = {}  # Store sent prediction messages for editing
-        self.temporary_messages = {}  # Store temporary messages waiting for final edit
-        self.pending_edits = {}  # Store messages waiting for edit with indicators
-        
+        self.processed_messages = BoundedDict(MAX_PROCESSED_MESSAGES)  # Avoid duplicate processing ((game, combination) -> monotonic time)
+        self.sent_predictions = BoundedDict(STATE_RETENTION)  # Store sent prediction messages for editing (same retention as on disk)
+        self.temporary_messages = BoundedDict(MAX_TRACKED_MESSAGES)  # Store temporary messages waiting for final edit
+        self.pending_edits = BoundedDict(MAX_TRACKED_MESSAGES)  # Store messages waiting for edit with indicators
+        self._pending_games = []  # Sorted game numbers whose prediction is still pending
+        # Games changed since the last flush, written to disk in one transaction
+        self._dirty_predictions = set()
+        self._dirty_sent = set()
+        self._store = None
+        if state_path:
+            self._load_state(state_path)
+    
+    def _load_state(self, state_path: str) -> None:
+        """Open the on-disk store and use its content as the in-memory cache"""
+        try:
+            self._store = PredictionStore(state_path)
+            self.predictions, sent_predictions = self._store.load()
+            self.sent_predictions.update(sent_predictions)
+        except sqlite3.Error as e:
+            logger.error(f"❌ État des prédictions non persistant ({state_path}): {e}")
+            self._store = None
+            return
+        # Messages envoyés sans prédiction sur disque: les reprendre comme prédictions en attente.
+        # record_sent_prediction suit toujours make_prediction, donc ce cas n'existe qu'au chargement
+        for predicted_game in self.sent_predictions.keys() - self.predictions.keys():
+            self.predictions[predicted_game] = {
+                'status': 'pending',
+                'message_info': self.sent_predictions[predicted_game]
+            }
+            self._dirty_predictions.add(predicted_game)
+        self._pending_games = sorted(
+            game for game, prediction in self.predictions.items() if prediction.get('status') == 'pending'
+        )
+        logger.info(f"💾 État restauré: {len(self.predictions)} prédictions, {len(self._pending_games)} en attente")
+    
+    def flush(self) -> None:
+        """Persist every prediction changed since the last flush in a single transaction"""
+        if self._store is None or not (self._dirty_predictions or self._dirty_sent):
+            return
+        try:
+            self._store.save(
+                [(game, self.predictions[game]) for game in self._dirty_predictions if game in self.predictions],
+                [(game, self.sent_predictions[game]) for game in self._dirty_sent if game in self.sent_predictions]
+            )
+        except sqlite3.Error as e:
+            logger.error(f"❌ Erreur sauvegarde état des prédictions: {e}")
+            return
+        self._dirty_predictions.clear()
+        self._dirty_sent.clear()
+    
+    def record_sent_prediction(self, game_number: int, chat_id: int, message_id: int) -> None:
+        """Remember the Telegram message holding a prediction so it can be edited later"""
+        self.sent_predictions[game_number] = {
+            'chat_id': chat_id,
+            'message_id': message_id
+        }
+        self._dirty_sent.add(game_number)
+    
     def reset_predictions(self):
         """Reset all prediction states - useful for recalibration"""
         self.predictions.clear()
@@ -35,30 +228,62 @@ class CardPredictor:
         self.sent_predictions.clear()
         self.temporary_messages.clear()
         self.pending_edits.clear()
+        self._pending_games.clear()
+        self._dirty_predictions.clear()
+        self._dirty_sent.clear()
+        if self._store is not None:
+            self._store.clear()
         logger.info("🔄 Système de prédictions réinitialisé")
     
+    def _is_processed(self, key: Tuple[int, str]) -> bool:
+        """Check whether a (game, combination) decision was already made within the TTL window"""
+        seen_at = self.processed_messages.get(key)
+        if seen_at is None:
+            return False
+        if time.monotonic() - seen_at > PROCESSED_MESSAGE_TTL:
+            del self.processed_messages[key]
+            return False
+        return True
+    
+    def _mark_processed(self, key: Tuple[int, str]) -> None:
+        """Remember a (game, combination) decision, evicting expired and least recent entries"""
+        now = time.monotonic()
+        processed = self.processed_messages
+        processed[key] = now
+        while now - next(iter(processed.values())) > PROCESSED_MESSAGE_TTL:
+            processed.popitem(last=False)
+    
+    def _track_pending(self, game_number: int) -> None:
+        """Add a game to the sorted pending index"""
+        index = bisect_right(self._pending_games, game_number)
+        if not index or self._pending_games[index - 1] != game_number:
+            self._pending_games.insert(index, game_number)
+    
+    def _untrack_pending(self, game_number: int) -> None:
+        """Remove a game from the sorted pending index once its prediction is settled"""
+        index = bisect_right(self._pending_games, game_number) - 1
+        if index >= 0 and self._pending_games[index] == game_number:
+            del self._pending_games[index]
+    
     def extract_game_number(self, message: str) -> Optional[int]:
         """Extract game number from message like #n744 or #N744"""
-        pattern = r'#[nN](\d+)'
-        match = re.search(pattern, message)
-        if match:
-            return int(match.group(1))
-        return None
+        return _parse_game_number(message)
+    
+    def parse_message(self, text: str) -> ParsedMessage:
+        """Parse a message once for should_predict_parsed / verify_prediction_from_edit_parsed"""
+        return _parse_message(text)
     
-    def extract_cards_from_parentheses(self, message: str) -> List[str]:
-        """Extract cards from first and second parentheses"""
-        # This method is deprecated, use extract_card_symbols_from_parentheses instead
-        return []
+    def classify(self, text: str) -> int:
+        """Bitmask of the indicators in text: PENDING and/or COMPLETION"""
+        return _classify_message(text)
     
     def has_pending_indicators(self, text: str) -> bool:
         """Check if message contains indicators suggesting it will be edited"""
-        indicators = ['⏰', '▶', '🕐', '➡️']
-        return any(indicator in text for indicator in indicators)
+        return bool(_classify_message(text) & MESSAGE_PENDING)
     
     def has_completion_indicators(self, text: str) -> bool:
         """Check if message contains completion indicators after edit"""
-        completion_indicators = ['✅', '🔰']
-        return any(indicator in text for indicator in completion_indicators)
+        return bool(_classify_message(text) & MESSAGE_COMPLETION)
     
     def should_wait_for_edit(self, text: str, message_id: int) -> bool:
         """Determine if we should wait for this message to be edited"""
@@ -66,65 +291,31 @@ class CardPredictor:
             # Store this message as pending edit
             self.pending_edits[message_id] = {
                 'original_text': text,
-                'timestamp': datetime.now()
+                'timestamp': time.monotonic()
             }
             return True
         return False
     
     def extract_card_symbols_from_parentheses(self, text: str) -> List[List[str]]:
         """Extract unique card symbols from each parentheses section"""
-        # Find all parentheses content
-        pattern = r'\(([^)]+)\)'
-        matches = re.findall(pattern, text)
-        
-        all_sections = []
-        for match in matches:
-            # Normalize ❤️ to ♥️ for consistency
-            normalized_content = match.replace("❤️", "♥️")
-            
-            # Extract only unique card symbols (costumes) from this section
-            unique_symbols = set()
-            for symbol in ["♠️", "♥️", "♦️", "♣️"]:
-                if symbol in normalized_content:
-                    unique_symbols.add(symbol)
-            
-            all_sections.append(list(unique_symbols))
-        
-        return all_sections
+        return [list(_SYMBOLS_BY_MASK[mask]) for mask in _parse_suit_masks(text)]
     
     def has_three_different_cards(self, cards: List[str]) -> bool:
         """Check if there are exactly 3 different card symbols"""
-        unique_cards = list(set(cards))
-        logger.info(f"Checking cards: {cards}, unique: {unique_cards}, count: {len(unique_cards)}")
-        return len(unique_cards) == 3
+        unique_cards = frozenset(cards)
+        logger.info("Checking cards: %s, unique: %s, count: %d", cards, unique_cards, len(unique_cards))
+        return _has_three_different_cards(unique_cards)
     
-    def is_temporary_message(self, message: str) -> bool:
-        """Check if message contains temporary progress emojis"""
-        temporary_emojis = ['⏰', '▶', '🕐', '➡️']
-        return any(emoji in message for emoji in temporary_emojis)
-    
-    def is_final_message(self, message: str) -> bool:
-        """Check if message contains final completion emojis"""
-        final_emojis = ['✅', '🔰']
-        return any(emoji in message for emoji in final_emojis)
+    # Same indicator sets, kept under their historical names
+    is_temporary_message = has_pending_indicators
+    is_final_message = has_completion_indicators
     
     def get_card_combination(self, cards: List[str]) -> Optional[str]:
         """Get the combination of 3 different cards"""
-        unique_cards = list(set(cards))
-        if len(unique_cards) == 3:
-            combination = ''.join(sorted(unique_cards))
-            logger.info(f"Card combination found: {combination} from cards: {unique_cards}")
-            
-            # Check if this combination matches any valid pattern
-            for valid_combo in VALID_CARD_COMBINATIONS:
-                if set(combination) == set(valid_combo):
-                    logger.info(f"Valid combination matched: {valid_combo}")
-                    return combination
-            
-            # Accept any 3 different cards as valid
-            logger.info(f"Accepting 3 different cards as valid: {combination}")
-            return combination
-        return None
+        combination = _card_combination(frozenset(cards))
+        if combination is not None:
+            logger.info("Accepting 3 different cards as valid: %s", combination)
+        return combination
     
     def should_predict(self, message: str) -> Tuple[bool, Optional[int], Optional[str]]:
         """
@@ -132,66 +323,77 @@ class CardPredictor:
         RÈGLE: Regarde SEULEMENT le PREMIER parenthèse pour 3 costumes différents
         Returns: (should_predict, game_number, card_combination)
         """
+        # Cheap rejections first: no game number / parentheses at all
+        if '(' not in message or ('#n' not in message and '#N' not in message):
+            return False, None, None
+        return self.should_predict_parsed(_parse_message(message))
+    
+    def should_predict_parsed(self, parsed: ParsedMessage) -> Tuple[bool, Optional[int], Optional[str]]:
+        """should_predict on an already parsed message"""
+        message = parsed.text
+        if '(' not in message:
+            return False, None, None
+        
         # Extract game number
-        game_number = self.extract_game_number(message)
+        game_number = parsed.game_number
         if not game_number:
             return False, None, None
         
-        logger.debug(f"🔮 PRÉDICTION - Analyse du jeu {game_number}")
+        logger.debug("🔮 PRÉDICTION - Analyse du jeu %d", game_number)
         
         # Check if this is a temporary message (should wait for final edit)
-        if self.has_pending_indicators(message) and not self.has_completion_indicators(message):
-            logger.info(f"🔮 Jeu {game_number}: Message temporaire (⏰▶🕐➡️), attente finalisation")
+        flags = parsed.flags
+        if flags == MESSAGE_PENDING:
+            logger.debug("🔮 Jeu %d: Message temporaire (⏰▶🕐➡️), attente finalisation", game_number)
             self.temporary_messages[game_number] = message
             return False, None, None
             
         # Skip if we already have a prediction for this exact next game number
         next_game = game_number + 1
         if next_game in self.predictions and self.predictions[next_game].get('status') == 'pending':
-            logger.info(f"🔮 Jeu {game_number}: Prédiction N{next_game} déjà existante, éviter doublon")
+            logger.debug("🔮 Jeu %d: Prédiction N%d déjà existante, éviter doublon", game_number, next_game)
             return False, None, None
         
         # Check if this is a final message (has completion indicators)
-        if self.has_completion_indicators(message):
-            logger.info(f"🔮 Jeu {game_number}: Message final détecté (✅ ou 🔰)")
+        if flags & MESSAGE_COMPLETION:
+            logger.debug("🔮 Jeu %d: Message final détecté (✅ ou 🔰)", game_number)
             # Remove from temporary if it was there
             if game_number in self.temporary_messages:
                 del self.temporary_messages[game_number]
-                logger.info(f"🔮 Jeu {game_number}: Retiré des messages temporaires")
+                logger.debug("🔮 Jeu %d: Retiré des messages temporaires", game_number)
         
         # Si le message a encore des indicateurs d'attente, ne pas traiter
-        elif self.has_pending_indicators(message):
-            logger.info(f"🔮 Jeu {game_number}: Encore des indicateurs d'attente, pas de prédiction")
+        elif flags & MESSAGE_PENDING:
+            logger.debug("🔮 Jeu %d: Encore des indicateurs d'attente, pas de prédiction", game_number)
             return False, None, None
         
-        # Extract card symbols from each parentheses section
-        parentheses_sections = self.extract_card_symbols_from_parentheses(message)
-        if not parentheses_sections:
-            logger.info(f"🔮 Jeu {game_number}: Aucune parenthèse trouvée")
+        # Extract card symbols from the first parentheses section
+        # Only the FIRST section matters here, so later sections are never scanned
+        if parsed.first_section is None:
+            logger.debug("🔮 Jeu %d: Aucune parenthèse trouvée", game_number)
             return False, None, None
         
         # SYSTÈME DE PRÉDICTION: Check if FIRST parentheses section has exactly 3 different costumes
-        if len(parentheses_sections) > 0 and len(parentheses_sections[0]) == 3:
+        first_mask = _suit_mask(parsed.first_section)
+        if first_mask.bit_count() == 3:
             # Found first section with 3 different costumes - GENERATE PREDICTION FOR NEXT GAME
-            section_symbols = parentheses_sections[0]
-            combination = ''.join(sorted(section_symbols))
-            logger.info(f"🔮 PRÉDICTION - Jeu {game_number}: ✅ 3 costumes trouvés dans PREMIER parenthèse: {section_symbols}")
-            logger.info(f"🔮 RÈGLE PRÉDICTION RESPECTÉE: PREMIER parenthèse avec 3 costumes → génère prédiction pour jeu {game_number + 1}")
-            
-            # Prevent duplicate processing avec optimisation
-            message_hash = hash(message)
-            if message_hash not in self.processed_messages:
-                self.processed_messages.add(message_hash)
-                logger.info(f"🔮 PRÉDICTION - Jeu {game_number}: GÉNÉRATION RAPIDE")
-                return True, game_number, combination
-            else:
-                logger.info(f"🔮 PRÉDICTION - Jeu {game_number}: ⚠️ Déjà traité")
+            combination = _COMBINATION_BY_MASK[first_mask]
+            # Same game and combination already handled (edits often repeat the same result)
+            decision = (game_number, combination)
+            if self._is_processed(decision):
+                logger.debug("🔮 PRÉDICTION - Jeu %d déjà traité", game_number)
                 return False, None, None
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🔮 PRÉDICTION - Jeu %d: ✅ 3 costumes trouvés dans PREMIER parenthèse: %s", game_number, _SYMBOLS_BY_MASK[first_mask])
+                logger.debug("🔮 RÈGLE PRÉDICTION RESPECTÉE: PREMIER parenthèse avec 3 costumes → génère prédiction pour jeu %d", game_number + 1)
+            
+            self._mark_processed(decision)
+            logger.info("🔮 PRÉDICTION - Jeu %d: GÉNÉRATION RAPIDE", game_number)
+            return True, game_number, combination
         else:
-            first_count = len(parentheses_sections[0]) if len(parentheses_sections) > 0 else 0
-            logger.info(f"🔮 PRÉDICTION - Jeu {game_number}: PREMIER parenthèse a {first_count} costumes (besoin de 3)")
+            logger.debug("🔮 PRÉDICTION - Jeu %d: PREMIER parenthèse a %d costumes (besoin de 3)", game_number, first_mask.bit_count())
         
-        logger.info(f"🔮 PRÉDICTION - Jeu {game_number}: RÈGLE NON RESPECTÉE - Premier parenthèse n'a pas 3 costumes")
+        logger.debug("🔮 PRÉDICTION - Jeu %d: RÈGLE NON RESPECTÉE - Premier parenthèse n'a pas 3 costumes", game_number)
         return False, None, None
     
     def make_prediction(self, game_number: int, combination: str) -> str:
@@ -207,142 +409,128 @@ class CardPredictor:
             'verification_count': 0,
             'message_text': prediction_text
         }
+        self._track_pending(next_game)
+        self._dirty_predictions.add(next_game)
         
-        logger.info(f"Made prediction for game {next_game} based on combination {combination}")
+        logger.info("Made prediction for game %d based on combination %s", next_game, combination)
         return prediction_text
     
     def count_cards_in_winning_parentheses(self, message: str) -> int:
         """Count the number of card symbols in the parentheses that has the ✅ symbol"""
         # Split message at ✅ to find which section won
-        if '✅' not in message:
+        _, checkmark, remaining_text = message.partition('✅')
+        if not checkmark:
             return 0
-            
-        # Find the parentheses after ✅
-        checkmark_pos = message.find('✅')
-        remaining_text = message[checkmark_pos:]
-        
-        # Extract parentheses content after ✅
-        pattern = r'\(([^)]+)\)'
-        match = re.search(pattern, remaining_text)
         
-        if match:
-            winning_content = match.group(1)
-            # Normalize ❤️ to ♥️ for consistent counting
-            normalized_content = winning_content.replace("❤️", "♥️")
-            card_count = 0
-            for symbol in ["♠️", "♥️", "♦️", "♣️"]:
-                card_count += normalized_content.count(symbol)
-            logger.info(f"Found ✅ winning section: {winning_content}, card count: {card_count}")
-            return card_count
+        # Find the first non-empty parentheses after ✅
+        start = 0
+        while True:
+            left = remaining_text.find('(', start)
+            if left < 0:
+                return 0
+            right = remaining_text.find(')', left + 1)
+            if right < 0:
+                return 0
+            if right > left + 1:
+                break
+            start = left + 1
         
-        return 0
+        winning_content = remaining_text[left + 1:right]
+        card_count = len(_SUIT_CHARS_RE.findall(winning_content))
+        logger.info("Found ✅ winning section: %s, card count: %d", winning_content, card_count)
+        return card_count
     
     def count_cards_in_first_parentheses(self, message: str) -> int:
         """Count the total number of card symbols in the first parentheses"""
-        # Find first parentheses content
-        pattern = r'\(([^)]+)\)'
-        match = re.search(pattern, message)
-        
-        if match:
-            first_content = match.group(1)
-            # Normalize ❤️ to ♥️ for consistent counting
-            normalized_content = first_content.replace("❤️", "♥️")
-            card_count = 0
-            for symbol in ["♠️", "♥️", "♦️", "♣️"]:
-                card_count += normalized_content.count(symbol)
-            logger.info(f"Found first parentheses: {first_content}, card count: {card_count}")
+        return self._count_section_cards(_parse_message(message).first_section)
+    
+    def _count_section_cards(self, first_content: Optional[str]) -> int:
+        """Count the card symbols in the content of the first parentheses"""
+        if first_content is not None:
+            card_count = len(_SUIT_CHARS_RE.findall(first_content))
+            logger.info("Found first parentheses: %s, card count: %d", first_content, card_count)
             return card_count
         
         return 0
     
     def verify_prediction(self, message: str) -> Optional[Dict]:
         """Verify if a prediction was correct (regular messages)"""
-        return self._verify_prediction_common(message, is_edited=False)
+        return self._verify_prediction_common(_parse_message(message), is_edited=False)
     
     def verify_prediction_from_edit(self, message: str) -> Optional[Dict]:
         """Verify if a prediction was correct from edited message (enhanced verification)"""
-        return self._verify_prediction_common(message, is_edited=True)
+        return self._verify_prediction_common(_parse_message(message), is_edited=True)
     
-    def _verify_prediction_common(self, message: str, is_edited: bool = False) -> Optional[Dict]:
+    def verify_prediction_from_edit_parsed(self, parsed: ParsedMessage) -> Optional[Dict]:
+        """verify_prediction_from_edit on an already parsed message"""
+        return self._verify_prediction_common(parsed, is_edited=True)
+    
+    def _verify_prediction_common(self, parsed: ParsedMessage, is_edited: bool = False) -> Optional[Dict]:
         """
         Common verification logic - ONLY VERIFIES on EDITED messages
         RÈGLE: Regarde SEULEMENT le PREMIER parenthèse pour exactement 3 CARTES (pas costumes)
         """
-        game_number = self.extract_game_number(message)
-        if not game_number:
+        # Aucune prédiction en attente: rien à vérifier
+        if not self._pending_games:
             return None
         
-        logger.info(f"🔍 VÉRIFICATION SEULEMENT - Jeu {game_number} (édité: {is_edited})")
-        
-        # Vérifier TOUTES les prédictions en attente, priorité au jeu exact puis séquentiellement
-        predictions_to_check = []
-        
-        # Synchroniser sent_predictions avec predictions
-        for predicted_game, message_info in self.sent_predictions.items():
-            if predicted_game not in self.predictions:
-                self.predictions[predicted_game] = {
-                    'status': 'pending',
-                    'message_info': message_info
-                }
-            predictions_to_check.append(predicted_game)
+        game_number = parsed.game_number
+        if not game_number:
+            return None
         
-        # Ajouter prédictions existantes
-        for predicted_game in self.predictions.keys():
-            if predicted_game not in predictions_to_check:
-                predictions_to_check.append(predicted_game)
+        logger.debug("🔍 VÉRIFICATION SEULEMENT - Jeu %d (édité: %s)", game_number, is_edited)
         
-        # Trier par ordre de priorité : jeu exact d'abord, puis séquentiel
-        predictions_to_check = sorted(predictions_to_check)
+        # Seules les prédictions en attente jusqu'au jeu actuel sont candidates (index déjà trié)
+        # Les plus anciennes (décalage >= 4) restent incluses pour être marquées en échec
+        predictions_to_check = self._pending_games[:bisect_right(self._pending_games, game_number)]
         
         # VÉRIFICATION SÉQUENTIELLE - Continue jusqu'à trouver une correspondance
         for predicted_game in predictions_to_check:
-            prediction = self.predictions.get(predicted_game, {})
-            prediction_status = prediction.get('status', 'pending')
-            
-            # Passer les prédictions déjà traitées (correct, failed, ou verified_success)
-            if prediction_status not in ['pending']:
-                logger.info(f"🔍 ⏭️ Prédiction {predicted_game} ignorée - Statut: {prediction_status}")
-                continue
+            prediction = self.predictions[predicted_game]
                 
             verification_offset = game_number - predicted_game
-            logger.info(f"🔍 Vérification prédiction {predicted_game} vs jeu actuel {game_number}, décalage: {verification_offset}")
+            logger.debug("🔍 Vérification prédiction %d vs jeu actuel %d, décalage: %d", predicted_game, game_number, verification_offset)
             
             # VÉRIFICATION DANS LA FENÊTRE 0-3 (jeu exact, +1, +2, +3)
             if 0 <= verification_offset <= 3:
-                has_success_symbol = '✅' in message or '🔰' in message
-                logger.info(f"🔍 VÉRIFICATION - Jeu {game_number}: Symbole succès: {has_success_symbol}, Édité: {is_edited}")
-                logger.info(f"🔍 SYSTÈME DE VÉRIFICATION: Vérifie si jeu prédit {predicted_game} correspond au jeu actuel {game_number}")
+                has_success_symbol = bool(parsed.flags & MESSAGE_COMPLETION)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("🔍 VÉRIFICATION - Jeu %d: Symbole succès: %s, Édité: %s", game_number, has_success_symbol, is_edited)
+                    logger.debug("🔍 SYSTÈME DE VÉRIFICATION: Vérifie si jeu prédit %d correspond au jeu actuel %d", predicted_game, game_number)
                 
                 # SYSTÈME DE VÉRIFICATION: SEULEMENT sur messages édités avec symbole succès
                 if has_success_symbol and is_edited:
                     # RÈGLE CRITIQUE: Vérifier UNIQUEMENT le PREMIER parenthèse pour exactement 3 CARTES (pas costumes)
-                    first_parentheses_card_count = self.count_cards_in_first_parentheses(message)
+                    first_parentheses_card_count = self._count_section_cards(parsed.first_section)
                     first_parentheses_valid = first_parentheses_card_count == 3
                     
-                    logger.info(f"🔍 PREMIER parenthèse: {first_parentheses_card_count} cartes au total")
+                    logger.debug("🔍 PREMIER parenthèse: %d cartes au total", first_parentheses_card_count)
                     
                     if first_parentheses_valid:
                         # Succès trouvé - déterminer le statut selon le décalage
-                        status_map = {0: '✅0️⃣', 1: '✅1️⃣', 2: '✅2️⃣', 3: '✅3️⃣'}
-                        new_status = status_map[verification_offset]
+                        new_status = _STATUS_BY_OFFSET[verification_offset]
                         
-                        logger.info(f"🔍 ✅ VÉRIFICATION RÉUSSIE - PREMIER parenthèse a exactement 3 cartes")
-                        logger.info(f"🔍 RÈGLE VÉRIFICATION RESPECTÉE: Prédiction {predicted_game} trouvée au jeu {game_number} (décalage {verification_offset}) → {new_status}")
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("🔍 ✅ VÉRIFICATION RÉUSSIE - PREMIER parenthèse a exactement 3 cartes")
+                            logger.debug("🔍 RÈGLE VÉRIFICATION RESPECTÉE: Prédiction %d trouvée au jeu %d (décalage %d) → %s", predicted_game, game_number, verification_offset, new_status)
                         
-                        original_message = f"🔵{predicted_game} 🔵3K: statut :⏳"
-                        updated_message = f"🔵{predicted_game} 🔵3K: statut :{new_status}"
+                        original_message = PREDICTION_MESSAGE.format(numero=predicted_game)
+                        updated_message = STATUS_MESSAGE.format(numero=predicted_game, statut=new_status)
                         
                         prediction['status'] = 'correct'
                         prediction['verification_count'] = verification_offset
                         prediction['final_message'] = updated_message
                         
-                        logger.info(f"🔍 ✅ Prédiction {predicted_game} VÉRIFIÉE avec succès (décalage {verification_offset})")
-                        logger.info(f"🔍 📝 Message à mettre à jour: '{original_message}' → '{updated_message}'")
-                        logger.info(f"🔍 🛑 ARRÊT IMMÉDIAT - Succès trouvé, cette prédiction est terminée")
+                        logger.info("🔍 ✅ Prédiction %d VÉRIFIÉE avec succès (décalage %d)", predicted_game, verification_offset)
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("🔍 📝 Message à mettre à jour: '%s' → '%s'", original_message, updated_message)
+                            logger.debug("🔍 🛑 ARRÊT IMMÉDIAT - Succès trouvé, cette prédiction est terminée")
                         
                         # Marquer cette prédiction comme terminée pour éviter futures vérifications
                         prediction['status'] = 'verified_success'
                         prediction['final_verification_offset'] = verification_offset
+                        self._untrack_pending(predicted_game)
+                        self._dirty_predictions.add(predicted_game)
                         
                         return {
                             'type': 'update_message',
@@ -352,23 +540,26 @@ class CardPredictor:
                         }
                     else:
                         # Premier parenthèse n'a pas 3 cartes - continuer à vérifier jeux suivants  
-                        logger.info(f"🔍 ⏳ CONTINUE - PREMIER parenthèse a seulement {first_parentheses_card_count} cartes (besoin de 3)")
-                        logger.info(f"🔍 SYSTÈME DE VÉRIFICATION: Prédiction {predicted_game} continue vers jeu suivant")
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("🔍 ⏳ CONTINUE - PREMIER parenthèse a seulement %d cartes (besoin de 3)", first_parentheses_card_count)
+                            logger.debug("🔍 SYSTÈME DE VÉRIFICATION: Prédiction %d continue vers jeu suivant", predicted_game)
                 else:
                     # Pas de symbole de succès ou pas édité - pas de vérification
-                    logger.info(f"🔍 ⏸️ Pas de vérification - Symbole succès: {has_success_symbol}, Édité: {is_edited}")
+                    logger.debug("🔍 ⏸️ Pas de vérification - Symbole succès: %s, Édité: %s", has_success_symbol, is_edited)
             
             # Vérifier si on doit marquer comme échec après 4 jeux
             elif verification_offset >= 4:
                 # Après 4 jeux (0,1,2,3) sans succès, marquer comme échec
-                original_message = f"🔵{predicted_game} 🔵3K: statut :⏳"
-                updated_message = f"🔵{predicted_game} 🔵3K: statut :⭕⭕"
+                original_message = PREDICTION_MESSAGE.format(numero=predicted_game)
+                updated_message = STATUS_MESSAGE.format(numero=predicted_game, statut=FAILED_STATUS)
                 
                 prediction['status'] = 'failed'
                 prediction['final_message'] = updated_message
+                self._untrack_pending(predicted_game)
+                self._dirty_predictions.add(predicted_game)
                 
-                logger.info(f"🔍 ❌ Prédiction {predicted_game} ÉCHOUÉE - Aucun succès trouvé après 4 jeux (décalages 0-3)")
-                logger.info(f"🔍 🛑 ARRÊT de vérification - Échec confirmé pour prédiction {predicted_game}")
+                logger.info("🔍 ❌ Prédiction %d ÉCHOUÉE - Aucun succès trouvé après 4 jeux (décalages 0-3)", predicted_game)
+                logger.debug("🔍 🛑 ARRÊT de vérification - Échec confirmé pour prédiction %d", predicted_game)
                 return {
                     'type': 'update_message',
                     'predicted_game': predicted_game,
@@ -376,7 +567,7 @@ class CardPredictor:
                     'original_message': original_message
                 }
         
-        logger.info(f"🔍 Aucune prédiction à vérifier pour le jeu {game_number}")
+        logger.debug("🔍 Aucune prédiction à vérifier pour le jeu %d", game_number)
         return None
 
 # Global instance
@@ -14,6 +14,9 @@ class Config:
         self.WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
         self.PORT = self._get_clean_port()
         self.DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
+        self.WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '10'))
+        # Background threads processing webhook updates (channel updates always share the first one)
+        self.UPDATE_WORKERS = max(1, int(os.getenv('UPDATE_WORKERS', '1')))
         
         self._validate_config()
     
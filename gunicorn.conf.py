@@ -0,0 +1,12 @@
+"""
+Gunicorn settings picked up automatically from the working directory
+"""
+
+def post_fork(server, worker):
+    """Build the bot in each worker right after the fork instead of on the first update"""
+    from main import get_bot, setup_webhook
+    get_bot()
+    # Register the webhook once per deployment, not again when a worker is restarted
+    # (setup_webhook drops the pending updates)
+    if worker.age == 1:
+        setup_webhook()
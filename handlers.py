@@ -4,17 +4,22 @@ Event handlers for the Telegram bot - adapted for webhook deployment
 
 import logging
 import os
-from datetime import datetime, timedelta
-from collections import defaultdict
-from typing import Dict, Any
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
 
 logger = logging.getLogger(__name__)
 
-# Rate limiting storage
-user_message_counts = defaultdict(list)
+# Rate limiting storage: user_id -> [previous window count, current window count, window start]
+user_message_counts: Dict[int, List[float]] = {}
 
 # Target channel ID for Baccarat Kouamé
 TARGET_CHANNEL_ID = -1002682552255
+# Channels whose posts are processed; posts from any other channel are dropped on arrival
+TARGET_CHANNEL_IDS = frozenset({TARGET_CHANNEL_ID})
+# Game token every prediction/verification message carries (#nXXX / #NXXX)
+GAME_TOKENS = ('#n', '#N')
 
 # Configuration constants
 GREETING_MESSAGE = """
@@ -94,33 +99,84 @@ contactez l'administrateur du bot.
 🚀 Le bot est open source et peut être déployé facilement !
 """
 
+DEPLOYMENT_CAPTION = '📦 Package de déploiement pour render.com\n\n🎯 Tout est inclus pour déployer votre bot !'
+
 MAX_MESSAGES_PER_MINUTE = 30
 RATE_LIMIT_WINDOW = 60
+# Users idle for two windows (nothing left to weigh) are dropped every RATE_LIMIT_SWEEP_EVERY checks
+RATE_LIMIT_SWEEP_EVERY = 1000
+# Hard cap on tracked users between sweeps; the oldest entries go first
+MAX_TRACKED_USERS = 10000
+_rate_limit_checks = 0
+
+def _sweep_rate_limits(now: float) -> None:
+    """Forget users whose counters no longer affect the sliding window"""
+    # Snapshot first: private chats may be served by several update workers
+    idle = [user_id for user_id, counter in list(user_message_counts.items())
+            if now - counter[2] >= 2 * RATE_LIMIT_WINDOW]
+    for user_id in idle:
+        user_message_counts.pop(user_id, None)
 
 def is_rate_limited(user_id: int) -> bool:
-    """Check if user is rate limited"""
-    now = datetime.now()
-    user_messages = user_message_counts[user_id]
+    """Check if user is rate limited (sliding-window counter over two fixed windows)"""
+    global _rate_limit_checks
+    now = time.monotonic()
+    _rate_limit_checks += 1
+    if _rate_limit_checks % RATE_LIMIT_SWEEP_EVERY == 0:
+        _sweep_rate_limits(now)
+    
+    counter = user_message_counts.get(user_id)
+    if counter is None:
+        if len(user_message_counts) >= MAX_TRACKED_USERS:
+            _sweep_rate_limits(now)
+            while len(user_message_counts) >= MAX_TRACKED_USERS:
+                user_message_counts.pop(next(iter(user_message_counts)), None)
+        counter = user_message_counts[user_id] = [0, 0, now]
 
-    # Remove old messages outside the window
-    user_messages[:] = [msg_time for msg_time in user_messages 
-                       if now - msg_time < timedelta(seconds=RATE_LIMIT_WINDOW)]
+    # Advance by whole windows; the previous one only counts if it is the one that just ended
+    elapsed = now - counter[2]
+    if elapsed >= RATE_LIMIT_WINDOW:
+        windows = elapsed // RATE_LIMIT_WINDOW
+        counter[0] = counter[1] if windows == 1 else 0
+        counter[1] = 0
+        counter[2] += RATE_LIMIT_WINDOW * windows
+        elapsed = now - counter[2]
 
-    # Check if user exceeded limit
-    if len(user_messages) >= MAX_MESSAGES_PER_MINUTE:
+    # Previous window weighted by how much of it still overlaps the last RATE_LIMIT_WINDOW seconds
+    estimated = counter[0] * (1 - elapsed / RATE_LIMIT_WINDOW) + counter[1]
+    if estimated >= MAX_MESSAGES_PER_MINUTE:
         return True
 
-    # Add current message time
-    user_messages.append(now)
+    counter[1] += 1
     return False
 
+@dataclass(slots=True)
+class Edit:
+    """Fields of an edited message read once at the top of the handler"""
+    chat_id: int
+    message_id: Optional[int]
+    sender_chat_id: Optional[int]
+    text: Optional[str]
+    
+    @classmethod
+    def from_message(cls, message: Dict[str, Any]) -> 'Edit':
+        """Read the fields from a Telegram message dict, without throwaway {} defaults"""
+        sender_chat = message.get('sender_chat')
+        return cls(
+            message['chat']['id'],
+            message.get('message_id'),
+            sender_chat.get('id') if sender_chat else None,
+            message.get('text')
+        )
+
 class TelegramHandlers:
     """Handlers for Telegram bot using webhook approach"""
     
-    def __init__(self, bot_token: str):
-        self.bot_token = bot_token
-        self.base_url = f"https://api.telegram.org/bot{bot_token}"
-        self.deployment_file_path = "deployment.zip"
+    def __init__(self, bot):
+        # Messages and edits go through the bot's throttled send path (rate limiter, retries)
+        self._bot = bot
+        # Lets the prediction send and the verification edit of one update overlap
+        self._io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='telegram-io')
         # Import card_predictor locally to avoid circular imports
         try:
             from card_predictor import card_predictor
@@ -128,23 +184,47 @@ class TelegramHandlers:
         except ImportError:
             logger.error("Failed to import card_predictor")
             self.card_predictor = None
+        # Predictor entry points used on every edited update, resolved once
+        if self.card_predictor:
+            cp = self.card_predictor
+            self._parse_message = cp.parse_message
+            self._should_predict = cp.should_predict_parsed
+            self._make_prediction = cp.make_prediction
+            self._verify_from_edit = cp.verify_prediction_from_edit_parsed
+            self._record_sent_prediction = cp.record_sent_prediction
+            self._sent_predictions = cp.sent_predictions
         
     def handle_update(self, update: Dict[str, Any]) -> None:
         """Handle incoming Telegram update with enhanced webhook support"""
+        # Posts sent on behalf of a channel we don't follow: nothing to do
+        message = update.get('edited_message') or update.get('message')
+        is_private = False
+        if message:
+            is_private = message.get('chat', {}).get('type') == 'private'
+            sender_chat = message.get('sender_chat')
+            if sender_chat is not None and sender_chat.get('id') not in TARGET_CHANNEL_IDS and not is_private:
+                return
+        
         try:
             if 'message' in update:
                 message = update['message']
-                logger.info(f"🔄 Handlers - Traitement message normal")
+                logger.info("🔄 Handlers - Traitement message normal")
                 self._handle_message(message)
             elif 'edited_message' in update:
                 message = update['edited_message']
-                logger.info(f"🔄 Handlers - Traitement message édité pour prédictions/vérifications")
+                logger.info("🔄 Handlers - Traitement message édité pour prédictions/vérifications")
                 self._handle_edited_message(message)
             else:
-                logger.info(f"⚠️ Type d'update non géré: {list(update.keys())}")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("⚠️ Type d'update non géré: %s", list(update.keys()))
                 
         except Exception as e:
             logger.error(f"Error handling update: {e}")
+        finally:
+            # One transaction per update for all prediction state changes. Private chats never touch
+            # the predictor and run on other update workers, so only the owning worker flushes
+            if self.card_predictor and not is_private:
+                self.card_predictor.flush()
     
     def _handle_message(self, message: Dict[str, Any]) -> None:
         """Handle regular messages"""
@@ -192,85 +272,91 @@ class TelegramHandlers:
     def _handle_edited_message(self, message: Dict[str, Any]) -> None:
         """Handle edited messages with enhanced webhook processing for predictions and verification"""
         try:
-            chat_id = message['chat']['id']
-            chat_type = message['chat'].get('type', 'private')
-            user_id = message.get('from', {}).get('id')
-            message_id = message.get('message_id')
-            sender_chat = message.get('sender_chat', {})
-            sender_chat_id = sender_chat.get('id')
-            
-            logger.info(f"✏️ WEBHOOK - Message édité reçu ID:{message_id} | Chat:{chat_id} | Sender:{sender_chat_id}")
+            cp = self.card_predictor
+            edit = Edit.from_message(message)
             
-            # Rate limiting check (skip for channels/groups)
-            if user_id and chat_type == 'private' and is_rate_limited(user_id):
+            # Vérifier d'abord que c'est du canal autorisé: le reste est inutile sinon
+            if edit.sender_chat_id not in TARGET_CHANNEL_IDS:
+                logger.debug("🚫 Message édité ignoré - Canal non autorisé: %s", edit.sender_chat_id)
                 return
             
+            logger.info("✏️ WEBHOOK - Message édité reçu ID:%s | Chat:%s | Sender:%s", edit.message_id, edit.chat_id, edit.sender_chat_id)
+            
             # Process edited messages
-            if 'text' in message:
-                text = message['text']
-                logger.info(f"✏️ WEBHOOK - Contenu édité: {text[:100]}...")
+            if edit.text:
+                logger.info("✏️ WEBHOOK - Contenu édité: %.100s...", edit.text)
                 
                 # Skip card prediction if card_predictor is not available
-                if not self.card_predictor:
+                if not cp:
                     logger.warning("❌ Card predictor not available")
                     return
                 
-                # Vérifier que c'est du canal autorisé
-                if sender_chat_id != TARGET_CHANNEL_ID:
-                    logger.info(f"🚫 Message édité ignoré - Canal non autorisé: {sender_chat_id}")
+                # Sans numéro de jeu, ni prédiction ni vérification possible
+                if not any(token in edit.text for token in GAME_TOKENS):
+                    logger.debug("✏️ Édition sans numéro de jeu ignorée")
                     return
                 
-                logger.info(f"✅ WEBHOOK - Message édité du canal autorisé: {TARGET_CHANNEL_ID}")
+                logger.info("✅ WEBHOOK - Message édité du canal autorisé: %s", TARGET_CHANNEL_ID)
                 
                 # TRAITEMENT MESSAGES ÉDITÉS - Les deux systèmes fonctionnent ici
-                if self.card_predictor.has_completion_indicators(text):
-                    logger.info(f"🎯 ÉDITION - Message finalisé détecté, traitement des deux systèmes")
+                # Numéro de jeu, premier parenthèse et indicateurs analysés une seule fois
+                parsed = self._parse_message(edit.text)
+                flags = parsed.flags
+                if flags & cp.COMPLETION:
+                    logger.info("🎯 ÉDITION - Message finalisé détecté, traitement des deux systèmes")
+                    
+                    # Les appels réseau des deux systèmes partent en parallèle;
+                    # l'état du prédicteur reste modifié sur ce thread uniquement
+                    prediction_future = None
+                    edit_future = None
                     
                     # SYSTÈME 1: PRÉDICTION AUTOMATIQUE (SEULEMENT sur messages édités)
-                    should_predict, game_number, combination = self.card_predictor.should_predict(text)
+                    should_predict, game_number, combination = self._should_predict(parsed)
                     
                     if should_predict and game_number is not None and combination is not None:
-                        prediction = self.card_predictor.make_prediction(game_number, combination)
-                        logger.info(f"🔮 PRÉDICTION depuis ÉDITION: {prediction}")
-                        
-                        # Envoyer la prédiction et stocker pour futures vérifications
-                        sent_message_info = self.send_message(chat_id, prediction)
-                        if sent_message_info and isinstance(sent_message_info, dict) and 'message_id' in sent_message_info:
-                            next_game = game_number + 1
-                            self.card_predictor.sent_predictions[next_game] = {
-                                'chat_id': chat_id,
-                                'message_id': sent_message_info['message_id']
-                            }
-                            logger.info(f"📝 Prédiction stockée pour jeu {next_game}")
+                        prediction = self._make_prediction(game_number, combination)
+                        logger.info("🔮 PRÉDICTION depuis ÉDITION: %s", prediction)
+                        # Une prédiction identique déjà postée (update redélivré, envoi incertain) n'est pas renvoyée
+                        prediction_future = self._io_executor.submit(self.send_message, edit.chat_id, prediction, dedupe=True)
                     
                     # SYSTÈME 2: VÉRIFICATION (SEULEMENT sur messages édités)
-                    verification_result = self.card_predictor.verify_prediction_from_edit(text)
+                    verification_result = self._verify_from_edit(parsed)
                     if verification_result:
-                        logger.info(f"🔍 VÉRIFICATION depuis ÉDITION: {verification_result}")
+                        logger.info("🔍 VÉRIFICATION depuis ÉDITION: %s", verification_result)
                         if verification_result['type'] == 'update_message':
                             # Essayer d'éditer le message original de prédiction
                             predicted_game = verification_result['predicted_game']
-                            if predicted_game in self.card_predictor.sent_predictions:
-                                message_info = self.card_predictor.sent_predictions[predicted_game]
-                                edit_success = self.edit_message(
+                            message_info = self._sent_predictions.get(predicted_game)
+                            if message_info is not None:
+                                edit_future = self._io_executor.submit(
+                                    self.edit_message,
                                     message_info['chat_id'],
                                     message_info['message_id'],
                                     verification_result['new_message']
                                 )
-                                if edit_success:
-                                    logger.info(f"✅ Message de prédiction édité pour jeu {predicted_game}")
-                                else:
-                                    self.send_message(chat_id, verification_result['new_message'])
                             else:
-                                self.send_message(chat_id, verification_result['new_message'])
+                                self._io_executor.submit(self.send_message, edit.chat_id, verification_result['new_message'], dedupe=True)
+                    
+                    # Envoyer la prédiction et stocker pour futures vérifications
+                    if prediction_future is not None:
+                        sent_message_info = prediction_future.result()
+                        if sent_message_info and isinstance(sent_message_info, dict) and 'message_id' in sent_message_info:
+                            next_game = game_number + 1
+                            self._record_sent_prediction(
+                                next_game, edit.chat_id, sent_message_info['message_id']
+                            )
+                            logger.info("📝 Prédiction stockée pour jeu %d", next_game)
+                    
+                    if edit_future is not None and edit_future.result():
+                        logger.info("✅ Message de prédiction édité pour jeu %d", predicted_game)
                 
                 # Gestion des messages temporaires
-                elif self.card_predictor.has_pending_indicators(text):
-                    logger.info(f"⏰ WEBHOOK - Message temporaire détecté, en attente de finalisation")
-                    if message_id:
-                        self.card_predictor.pending_edits[message_id] = {
-                            'original_text': text,
-                            'timestamp': datetime.now()
+                elif flags & cp.PENDING:
+                    logger.info("⏰ WEBHOOK - Message temporaire détecté, en attente de finalisation")
+                    if edit.message_id:
+                        cp.pending_edits[edit.message_id] = {
+                            'original_text': edit.text,
+                            'timestamp': time.monotonic()
                         }
                 
         except Exception as e:
@@ -285,26 +371,26 @@ class TelegramHandlers:
             sender_chat_id = sender_chat.get('id')
             
             # Only process messages from Baccarat Kouamé channel
-            if sender_chat_id != TARGET_CHANNEL_ID:
-                logger.info(f"🚫 Message ignoré - Canal non autorisé: {sender_chat_id} (attendu: {TARGET_CHANNEL_ID})")
+            if sender_chat_id not in TARGET_CHANNEL_IDS:
+                logger.info("🚫 Message ignoré - Canal non autorisé: %s (attendu: %s)", sender_chat_id, TARGET_CHANNEL_ID)
                 return
                 
             if not text or not self.card_predictor:
                 return
                 
-            logger.info(f"🎯 Traitement message CANAL AUTORISÉ pour prédiction: {text[:50]}...")
-            logger.info(f"📍 Canal source: {sender_chat_id} | Chat destination: {chat_id}")
+            logger.info("🎯 Traitement message CANAL AUTORISÉ pour prédiction: %.50s...", text)
+            logger.info("📍 Canal source: %s | Chat destination: %s", sender_chat_id, chat_id)
             
             # IMPORTANT: Les messages normaux ne font PAS de prédiction ni de vérification
             # Seuls les messages ÉDITÉS déclenchent les systèmes de prédiction et vérification
-            logger.info(f"📨 Message normal - AUCUNE ACTION (prédiction et vérification se font SEULEMENT sur messages édités)")
+            logger.info("📨 Message normal - AUCUNE ACTION (prédiction et vérification se font SEULEMENT sur messages édités)")
             
             # Store temporary messages with pending indicators
             if self.card_predictor.has_pending_indicators(text):
                 message_id = message.get('message_id')
                 if message_id:
                     self.card_predictor.temporary_messages[message_id] = text
-                    logger.info(f"⏰ Message temporaire stocké: {message_id}")
+                    logger.info("⏰ Message temporaire stocké: %s", message_id)
                 
         except Exception as e:
             logger.error(f"Error processing card message: {e}")
@@ -323,7 +409,7 @@ class TelegramHandlers:
                 
                 if should_predict and game_number is not None and combination is not None:
                     prediction = self.card_predictor.make_prediction(game_number, combination)
-                    logger.info(f"Making prediction from completed edit: {prediction}")
+                    logger.info("Making prediction from completed edit: %s", prediction)
                     
                     # Send prediction to the chat
                     self.send_message(chat_id, prediction)
@@ -331,7 +417,7 @@ class TelegramHandlers:
                 # Also check for verification with enhanced logic for edited messages
                 verification_result = self.card_predictor.verify_prediction_from_edit(text)
                 if verification_result:
-                    logger.info(f"Verification from completed edit: {verification_result}")
+                    logger.info("Verification from completed edit: %s", verification_result)
                     
                     if verification_result['type'] == 'update_message':
                         self.send_message(chat_id, verification_result['new_message'])
@@ -400,14 +486,14 @@ class TelegramHandlers:
             elif chat_type in ['group', 'supergroup', 'channel'] and self.card_predictor:
                 # Check if this message has pending indicators
                 if message_id and self.card_predictor.should_wait_for_edit(text, message_id):
-                    logger.info(f"Message {message_id} has pending indicators, waiting for edit: {text[:50]}...")
+                    logger.info("Message %s has pending indicators, waiting for edit: %.50s...", message_id, text)
                     # Don't process for predictions yet, wait for the edit
                     return
                 
                 # Les messages normaux dans les groupes/canaux ne font PAS de prédiction ni vérification
                 # Seuls les messages ÉDITÉS déclenchent les systèmes
-                logger.info(f"📨 Message normal groupe/canal - AUCUNE ACTION (systèmes actifs seulement sur éditions)")
-                logger.info(f"Group message in {chat_id}: {text[:50]}...")
+                logger.info("📨 Message normal groupe/canal - AUCUNE ACTION (systèmes actifs seulement sur éditions)")
+                logger.info("Group message in %s: %.50s...", chat_id, text)
                 
         except Exception as e:
             logger.error(f"Error handling regular message: {e}")
@@ -429,58 +515,15 @@ class TelegramHandlers:
         except Exception as e:
             logger.error(f"Error handling new chat members: {e}")
     
-    def send_message(self, chat_id: int, text: str) -> bool:
-        """Send text message to user"""
-        try:
-            import requests
-            
-            url = f"{self.base_url}/sendMessage"
-            data = {
-                'chat_id': chat_id,
-                'text': text,
-                'parse_mode': 'HTML'
-            }
-            
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
-            
-            if result.get('ok'):
-                logger.info(f"Message sent successfully to chat {chat_id}")
-                return result.get('result', {})  # Return message info including message_id
-            else:
-                logger.error(f"Failed to send message: {result}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error sending message: {e}")
-            return False
+    def send_message(self, chat_id: int, text: str, *, dedupe: bool = False):
+        """Send text message to user, returning the message info (including message_id) or False.
+        dedupe drops an identical send to the same chat within the bot's idempotency window"""
+        return self._bot.send_message(chat_id, text, dedupe=dedupe)
     
     def send_document(self, chat_id: int, file_path: str) -> bool:
         """Send document file to user"""
         try:
-            import requests
-            
-            url = f"{self.base_url}/sendDocument"
-            
-            with open(file_path, 'rb') as file:
-                files = {
-                    'document': (os.path.basename(file_path), file, 'application/zip')
-                }
-                data = {
-                    'chat_id': chat_id,
-                    'caption': '📦 Package de déploiement pour render.com\n\n🎯 Tout est inclus pour déployer votre bot !'
-                }
-                
-                response = requests.post(url, data=data, files=files, timeout=60)
-                result = response.json()
-                
-                if result.get('ok'):
-                    logger.info(f"Document sent successfully to chat {chat_id}")
-                    return True
-                else:
-                    logger.error(f"Failed to send document: {result}")
-                    return False
-                    
+            return self._bot.send_document(chat_id, file_path, DEPLOYMENT_CAPTION)
         except FileNotFoundError:
             logger.error(f"File not found: {file_path}")
             return False
@@ -490,27 +533,4 @@ class TelegramHandlers:
     
     def edit_message(self, chat_id: int, message_id: int, new_text: str) -> bool:
         """Edit an existing message"""
-        try:
-            import requests
-            
-            url = f"{self.base_url}/editMessageText"
-            data = {
-                'chat_id': chat_id,
-                'message_id': message_id,
-                'text': new_text,
-                'parse_mode': 'HTML'
-            }
-            
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
-            
-            if result.get('ok'):
-                logger.info(f"Message edited successfully in chat {chat_id}")
-                return True
-            else:
-                logger.error(f"Failed to edit message: {result}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error editing message: {e}")
-            return False
\ No newline at end of file
+        return self._bot.edit_message(chat_id, message_id, new_text)
@@ -4,29 +4,120 @@ Optimized for webhook-based communication with automatic predictions
 """
 import os
 import logging
-from flask import Flask, request
+import orjson
+import queue
+import threading
+from collections import OrderedDict
+from flask import Flask, Response, request
 from bot import TelegramBot
 from config import Config
 
-# Configure logging
+# Configure logging (LOG_LEVEL=WARNING silences the per-update INFO lines)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').strip().upper()
+_log_level_valid = LOG_LEVEL in logging.getLevelNamesMapping()
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    level=LOG_LEVEL if _log_level_valid else logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    # Render already timestamps each line; a short time without milliseconds is enough
+    datefmt='%H:%M:%S'
 )
 logger = logging.getLogger(__name__)
+if not _log_level_valid:
+    logger.warning(f"⚠️ LOG_LEVEL invalide '{LOG_LEVEL}', INFO utilisé")
 
 # Initialize Flask app
 app = Flask(__name__)
 
-# Initialize bot configuration and instance
+# Initialize bot configuration
 config = Config()
-bot = TelegramBot(config.BOT_TOKEN)
+
+# The bot (HTTP pools, thread pools, prediction state) is created in the serving process,
+# never in gunicorn's --preload master, so nothing is shared across the fork
+_bot = None
+_bot_lock = threading.Lock()
+
+def get_bot() -> TelegramBot:
+    """Return this process's bot, creating it on first use"""
+    global _bot
+    if _bot is None:
+        with _bot_lock:
+            if _bot is None:
+                _bot = TelegramBot(config.BOT_TOKEN, max_connections=config.WEBHOOK_MAX_CONNECTIONS)
+    return _bot
+
+# Updates are acknowledged immediately and processed by background workers, one queue each.
+# Channel/group updates (the only ones touching prediction state) all go to the first queue,
+# so the predictor has a single writer and needs no lock; private chats are spread by chat id
+UPDATE_QUEUE_SIZE = 2048
+update_queues = [queue.Queue(maxsize=UPDATE_QUEUE_SIZE) for _ in range(config.UPDATE_WORKERS)]
+_workers_started = False
+_workers_lock = threading.Lock()
+# Recently accepted update_ids, so Telegram redeliveries are acknowledged without reprocessing
+RECENT_UPDATE_IDS_SIZE = 4096
+_recent_update_ids = OrderedDict()
+_recent_update_ids_lock = threading.Lock()
+
+def _update_shard(update) -> int:
+    """Index of the queue owning this update"""
+    message = update.get('message') or update.get('edited_message') or {}
+    chat = message.get('chat') or {}
+    if chat.get('type') == 'private':
+        return chat.get('id', 0) % len(update_queues)
+    return 0
+
+def _update_worker(update_queue: queue.Queue):
+    """Process the updates of one queue one by one"""
+    while True:
+        update = update_queue.get()
+        try:
+            get_bot().handle_update(update)
+            logger.debug("✅ Update traité avec succès")
+        except Exception as e:
+            logger.error(f"❌ Error processing update: {e}")
+        finally:
+            update_queue.task_done()
+
+def _is_duplicate_update(update_id) -> bool:
+    """Record update_id and tell whether it was already seen"""
+    if update_id is None:
+        return False
+    with _recent_update_ids_lock:
+        if update_id in _recent_update_ids:
+            return True
+        _recent_update_ids[update_id] = None
+        if len(_recent_update_ids) > RECENT_UPDATE_IDS_SIZE:
+            _recent_update_ids.popitem(last=False)
+    return False
+
+def _ensure_workers():
+    """Start the workers in the serving process (threads do not survive gunicorn's fork after --preload)"""
+    global _workers_started
+    if _workers_started:
+        return
+    with _workers_lock:
+        if _workers_started:
+            return
+        for index, update_queue in enumerate(update_queues):
+            threading.Thread(target=_update_worker, args=(update_queue,), name=f'update-worker-{index}',
+                             daemon=True).start()
+        _workers_started = True
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Handle incoming webhook from Telegram"""
     try:
-        update = request.get_json()
+        # Raw body parsed with orjson; Flask does not keep a copy of the buffer
+        raw = request.get_data(cache=False)
+        try:
+            update = orjson.loads(raw) if raw else None
+        except orjson.JSONDecodeError as e:
+            logger.warning(f"⚠️ Update JSON invalide: {e}")
+            return 'Bad Request', 400
+        if not isinstance(update, dict):
+            return 'OK', 200
+        if _is_duplicate_update(update.get('update_id')):
+            logger.info("🔁 Update déjà reçu, ignoré")
+            return 'OK', 200
         
         if 'message' in update:
             logger.info("📨 Webhook - Message normal reçu")
@@ -34,23 +125,31 @@ def webhook():
             logger.info("✏️ Webhook - Message édité reçu")
         
         if update:
-            bot.handle_update(update)
-            logger.info("✅ Update traité avec succès via webhook")
+            _ensure_workers()
+            try:
+                update_queues[_update_shard(update)].put_nowait(update)
+            except queue.Full:
+                # Dropping beats a 5xx, which makes Telegram back off and redeliver
+                logger.warning("⚠️ File des updates pleine, update ignoré")
         
         return 'OK', 200
     except Exception as e:
         logger.error(f"❌ Error handling webhook: {e}")
         return 'Error', 500
 
+# Static probe responses serialized once at import
+HEALTH_BODY = orjson.dumps({'status': 'healthy', 'service': 'telegram-bot'})
+HOME_BODY = orjson.dumps({'message': 'Telegram Bot is running', 'status': 'active'})
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for Render.com"""
-    return {'status': 'healthy', 'service': 'telegram-bot'}, 200
+    return Response(HEALTH_BODY, status=200, mimetype='application/json')
 
 @app.route('/', methods=['GET'])
 def home():
     """Root endpoint"""
-    return {'message': 'Telegram Bot is running', 'status': 'active'}, 200
+    return Response(HOME_BODY, status=200, mimetype='application/json')
 
 def setup_webhook():
     """Set up webhook on startup for Render.com deployment"""
@@ -60,7 +159,8 @@ def setup_webhook():
             full_webhook_url = f"{webhook_url}/webhook"
             logger.info(f"🔗 Configuration webhook pour Render.com: {full_webhook_url}")
             
-            success = bot.set_webhook(full_webhook_url)
+            # Skip the backlog queued while the service was down
+            success = get_bot().set_webhook(full_webhook_url, drop_pending_updates=True)
             if success:
                 logger.info(f"✅ Webhook configuré avec succès sur Render.com")
                 logger.info(f"🎯 Bot prêt pour prédictions automatiques")
@@ -72,7 +172,7 @@ def setup_webhook():
         logger.error(f"❌ Erreur configuration webhook: {e}")
 
 if __name__ == '__main__':
-    # Set up webhook on startup
+    # Set up webhook on startup (under gunicorn, the post_fork hook does it)
     setup_webhook()
 
     # Get port from environment (Render.com provides this dynamically)
@@ -86,4 +186,4 @@ if __name__ == '__main__':
     logger.info(f"🚀 Démarrage serveur sur port {port}")
 
     # Run Flask app optimized for Render.com
-    app.run(host='0.0.0.0', port=port, debug=False)
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
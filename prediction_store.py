@@ -0,0 +1,84 @@
+"""
+SQLite persistence for prediction state so it survives restarts and redeploys
+"""
+import logging
+import orjson
+import sqlite3
+from typing import Dict, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Only the most recent games are kept on disk and reloaded on startup
+STATE_RETENTION = 1000
+
+class PredictionStore:
+    """Compact on-disk store for predictions and sent prediction messages"""
+
+    __slots__ = ('path', '_conn')
+
+    def __init__(self, path: str):
+        self.path = path
+        # Autocommit mode: transactions are opened explicitly so writes can be coalesced
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions (game INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sent_predictions "
+            "(game INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL)"
+        )
+
+    def load(self) -> Tuple[Dict[int, Dict], Dict[int, Dict]]:
+        """Load the retained predictions and sent prediction messages"""
+        predictions = {
+            game: orjson.loads(data)
+            for game, data in self._conn.execute(
+                "SELECT game, data FROM predictions ORDER BY game DESC LIMIT ?", (STATE_RETENTION,)
+            )
+        }
+        sent_predictions = {
+            game: {'chat_id': chat_id, 'message_id': message_id}
+            for game, chat_id, message_id in self._conn.execute(
+                "SELECT game, chat_id, message_id FROM sent_predictions ORDER BY game DESC LIMIT ?",
+                (STATE_RETENTION,)
+            )
+        }
+        # Rows were read newest first; keep the dicts in ascending game order
+        return dict(sorted(predictions.items())), dict(sorted(sent_predictions.items()))
+
+    def save(self, predictions: Iterable[Tuple[int, Dict]], sent_predictions: Iterable[Tuple[int, Dict]]) -> None:
+        """Write all changed rows in a single transaction and trim old games"""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO predictions (game, data) VALUES (?, ?)",
+                [(game, orjson.dumps(data).decode()) for game, data in predictions]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO sent_predictions (game, chat_id, message_id) VALUES (?, ?, ?)",
+                [(game, info['chat_id'], info['message_id']) for game, info in sent_predictions]
+            )
+            for table in ('predictions', 'sent_predictions'):
+                conn.execute(
+                    f"DELETE FROM {table} WHERE game NOT IN "
+                    f"(SELECT game FROM {table} ORDER BY game DESC LIMIT ?)", (STATE_RETENTION,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self) -> None:
+        """Remove all persisted state"""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM predictions")
+            conn.execute("DELETE FROM sent_predictions")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
@@ -0,0 +1,146 @@
+"""
+Client-side rate limiting for outbound Telegram API calls
+Keeps the bot under Telegram's quotas (~30 msg/s overall, ~1 msg/s per chat)
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Mapping
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_LIMIT = 30
+PER_CHAT_LIMIT = 1
+WINDOW_SECONDS = 1.0
+# Pause pre-emptively once the server reports less than this share of quota left
+HEADER_REMAINING_RATIO = 0.1
+# Chats with no send left in the window and no cooldown are forgotten every SWEEP_EVERY sends
+SWEEP_EVERY = 1000
+
+class RateLimiter:
+    """Sliding-window limiter with a global window and one window per chat"""
+
+    __slots__ = ('global_limit', 'per_chat_limit', 'window', '_lock', '_global_sent', '_chat_sent',
+                 '_global_blocked_until', '_chat_blocked_until', '_sends')
+
+    def __init__(self, global_limit: int = GLOBAL_LIMIT, per_chat_limit: int = PER_CHAT_LIMIT,
+                 window: float = WINDOW_SECONDS):
+        self.global_limit = global_limit
+        self.per_chat_limit = per_chat_limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._global_sent: Deque[float] = deque()
+        self._chat_sent: Dict[int, Deque[float]] = {}
+        self._global_blocked_until = 0.0
+        self._chat_blocked_until: Dict[int, float] = {}
+        self._sends = 0
+
+    def _delay(self, chat_id: int, now: float) -> float:
+        """Seconds to wait before a send to chat_id fits in every window"""
+        horizon = now - self.window
+        global_sent = self._global_sent
+        while global_sent and global_sent[0] <= horizon:
+            global_sent.popleft()
+        chat_sent = self._chat_sent.get(chat_id)
+        if chat_sent is not None:
+            while chat_sent and chat_sent[0] <= horizon:
+                chat_sent.popleft()
+
+        delay = max(self._global_blocked_until, self._chat_blocked_until.get(chat_id, 0.0)) - now
+        if len(global_sent) >= self.global_limit:
+            delay = max(delay, global_sent[0] + self.window - now)
+        if chat_sent is not None and len(chat_sent) >= self.per_chat_limit:
+            delay = max(delay, chat_sent[0] + self.window - now)
+        return delay
+
+    def _sweep(self, now: float) -> None:
+        """Drop per-chat state that no longer delays anything"""
+        horizon = now - self.window
+        idle = [chat_id for chat_id, chat_sent in self._chat_sent.items() if not chat_sent or chat_sent[-1] <= horizon]
+        for chat_id in idle:
+            del self._chat_sent[chat_id]
+        expired = [chat_id for chat_id, until in self._chat_blocked_until.items() if until <= now]
+        for chat_id in expired:
+            del self._chat_blocked_until[chat_id]
+
+    def wait(self, chat_id: int) -> None:
+        """Block until a message to chat_id can be sent, then reserve the slot"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self._delay(chat_id, now)
+                if delay <= 0:
+                    self._global_sent.append(now)
+                    chat_sent = self._chat_sent.get(chat_id)
+                    if chat_sent is None:
+                        chat_sent = self._chat_sent[chat_id] = deque()
+                    chat_sent.append(now)
+                    self._chat_blocked_until.pop(chat_id, None)
+                    self._sends += 1
+                    if self._sends % SWEEP_EVERY == 0:
+                        self._sweep(now)
+                    return
+            time.sleep(delay)
+
+    def cooldown(self, chat_id: int, seconds: float) -> None:
+        """Force a pause for chat_id, e.g. from a 429 retry_after"""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._chat_blocked_until.get(chat_id, 0.0):
+                self._chat_blocked_until[chat_id] = until
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Pause all sends when x-rate-limit-* headers report a nearly spent quota"""
+        try:
+            limit = int(headers['x-rate-limit-limit'])
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset = float(headers.get('x-rate-limit-reset', self.window))
+        except (KeyError, ValueError):
+            return
+        if limit > 0 and remaining <= limit * HEADER_REMAINING_RATIO:
+            logger.warning(f"Rate limit quota low ({remaining}/{limit}), pausing {reset:.1f}s")
+            with self._lock:
+                self._global_blocked_until = max(self._global_blocked_until, time.monotonic() + reset)
+
+# AIMD admission control for in-flight sends
+MIN_CONCURRENCY = 2
+LATENCY_WINDOW = 20
+TARGET_LATENCY = 0.3
+ADDITIVE_STEP = 0.5
+DECREASE_FACTOR = 0.5
+
+class ConcurrencyLimiter:
+    """Additive-increase / multiplicative-decrease gate on concurrent requests"""
+
+    __slots__ = ('min_concurrency', 'max_concurrency', 'target_latency', 'capacity', 'in_flight',
+                 '_latencies', '_cond')
+
+    def __init__(self, max_concurrency: int, min_concurrency: int = MIN_CONCURRENCY,
+                 target_latency: float = TARGET_LATENCY):
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.target_latency = target_latency
+        self.capacity = float(min_concurrency)
+        self.in_flight = 0
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        """Block until the number of in-flight requests is below the current capacity"""
+        with self._cond:
+            while self.in_flight >= int(self.capacity):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency: float, congested: bool) -> None:
+        """Free a slot and adapt capacity: grow on fast successes, halve on congestion"""
+        with self._cond:
+            self.in_flight -= 1
+            if congested:
+                self.capacity = max(self.min_concurrency, self.capacity * DECREASE_FACTOR)
+            else:
+                self._latencies.append(latency)
+                if sum(self._latencies) / len(self._latencies) <= self.target_latency:
+                    self.capacity = min(self.max_concurrency, self.capacity + ADDITIVE_STEP)
+            self._cond.notify_all()